@@ -10,12 +10,15 @@ This script prepares data for the heat hazard risk prediction model by:
 6. Exporting cleaned features for modeling
 
 Usage:
-    python data_preparation.py --output features.csv
+    python data_preparation.py --output features.parquet
 """
 
 import pandas as pd
 import geopandas as gpd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import shapely
 from datetime import datetime, timedelta
 import argparse
 import os
@@ -23,17 +26,41 @@ from shapely.geometry import Point
 import warnings
 warnings.filterwarnings('ignore')
 
+# Column groups of the exported feature set, known up front so cleaning does
+# not have to rediscover them from dtypes
+NUMERIC_COLS = {
+    'lat', 'lon', 'severity', 'temp', 'tavg', 'tmin', 'prcp',
+    'temp_roll3', 'tavg_roll3', 'tmin_roll3',
+    'dayofweek', 'month', 'dayofyear',
+    'urban_density', 'vegetation_cover', 'water_bodies'
+}
+CATEG_COLS = {'incident_type', 'season', 'landcover_type'}
+
 def load_bangalore_weather(csv_path):
     """
     Load Bangalore weather data and parse datetime
     """
     print(f"Loading weather data from {csv_path}...")
     
-    # Load the CSV file
-    df = pd.read_csv(csv_path)
+    # Load the CSV file with Arrow's multithreaded reader, reading only the
+    # columns we keep and the measurements straight into float32
+    table = pacsv.read_csv(
+        csv_path,
+        convert_options=pacsv.ConvertOptions(
+            include_columns=['time', 'tmax', 'tavg', 'tmin', 'prcp'],
+            column_types={
+                'time': pa.string(),
+                'tmax': pa.float32(),
+                'tavg': pa.float32(),
+                'tmin': pa.float32(),
+                'prcp': pa.float32(),
+            },
+        ),
+    )
+    df = table.to_pandas()
     
     # Parse the time column to datetime
-    df['time'] = pd.to_datetime(df['time'], format='%d-%m-%Y')
+    df['time'] = pd.to_datetime(df['time'], format='%d-%m-%Y', cache=True)
     
     # Rename tmax to temp as requested
     df = df.rename(columns={'tmax': 'temp'})
@@ -72,10 +99,11 @@ def compute_rolling_averages(df):
     # Sort by time to ensure proper rolling calculation
     df = df.sort_values('time').reset_index(drop=True)
     
-    # Compute 3-day rolling averages (3 days = 3 records for daily data)
-    df['temp_roll3'] = df['temp'].rolling(window=3, min_periods=1).mean()
-    df['tavg_roll3'] = df['tavg'].rolling(window=3, min_periods=1).mean()
-    df['tmin_roll3'] = df['tmin'].rolling(window=3, min_periods=1).mean()
+    # Compute 3-day rolling averages (3 days = 3 records for daily data),
+    # kept in the float32 width the measurements were loaded with
+    df['temp_roll3'] = df['temp'].rolling(window=3, min_periods=1).mean().astype(np.float32)
+    df['tavg_roll3'] = df['tavg'].rolling(window=3, min_periods=1).mean().astype(np.float32)
+    df['tmin_roll3'] = df['tmin'].rolling(window=3, min_periods=1).mean().astype(np.float32)
     
     print("Rolling averages computed successfully")
     return df
@@ -95,7 +123,7 @@ def load_incidents_data(incidents_path=None):
     else:
         print("No incidents file found, creating sample incidents data...")
         # Create sample incidents data for demonstration
-        np.random.seed(42)
+        rng = np.random.default_rng(42)
         n_incidents = 100
         
         # Generate random dates within the last year of available weather data
@@ -108,12 +136,13 @@ def load_incidents_data(incidents_path=None):
         bangalore_lat = 12.9716
         bangalore_lon = 77.5946
         
+        # One batched draw per column from a PCG64 generator
         incidents = pd.DataFrame({
             'timestamp': dates,
-            'lat': np.random.normal(bangalore_lat, 0.1, n_incidents),
-            'lon': np.random.normal(bangalore_lon, 0.1, n_incidents),
-            'incident_type': np.random.choice(['heat_stroke', 'fire', 'drought'], n_incidents),
-            'severity': np.random.randint(1, 6, n_incidents)
+            'lat': rng.normal(bangalore_lat, 0.1, n_incidents),
+            'lon': rng.normal(bangalore_lon, 0.1, n_incidents),
+            'incident_type': rng.choice(np.array(['heat_stroke', 'fire', 'drought']), n_incidents),
+            'severity': rng.integers(1, 6, n_incidents, dtype=np.int8)
         })
     
     print(f"Loaded {len(incidents)} incident records")
@@ -129,6 +158,7 @@ def load_landcover_data(landcover_path=None):
     else:
         print("No landcover file found, creating sample landcover data...")
         # Create sample landcover data for demonstration
+        rng = np.random.default_rng(42)
         bangalore_lat = 12.9716
         bangalore_lon = 77.5946
         
@@ -136,24 +166,26 @@ def load_landcover_data(landcover_path=None):
         lats = np.linspace(bangalore_lat - 0.2, bangalore_lat + 0.2, 5)
         lons = np.linspace(bangalore_lon - 0.2, bangalore_lon + 0.2, 5)
         
-        landcover_data = []
-        landcover_types = ['urban', 'vegetation', 'water', 'agriculture', 'bare_soil']
+        landcover_types = np.array(['urban', 'vegetation', 'water', 'agriculture', 'bare_soil'])
         
-        for i, lat in enumerate(lats):
-            for j, lon in enumerate(lons):
-                # Create a small polygon for each grid cell
-                from shapely.geometry import box
-                cell = box(lon - 0.02, lat - 0.02, lon + 0.02, lat + 0.02)
-                
-                landcover_data.append({
-                    'geometry': cell,
-                    'landcover_type': landcover_types[(i + j) % len(landcover_types)],
-                    'urban_density': np.random.uniform(0, 1),
-                    'vegetation_cover': np.random.uniform(0, 1),
-                    'water_bodies': np.random.uniform(0, 0.3)
-                })
+        # Build all grid cells in one vectorised call (row i = lat, column j = lon)
+        xx, yy = np.meshgrid(lons, lats)
+        cells = shapely.box(xx - 0.02, yy - 0.02, xx + 0.02, yy + 0.02).ravel()
+        type_idx = np.add.outer(np.arange(len(lats)), np.arange(len(lons))) % len(landcover_types)
         
-        landcover = gpd.GeoDataFrame(landcover_data, crs='EPSG:4326')
+        # Draw per-cell (urban, vegetation, water) attributes in one batch
+        draws = rng.uniform(0, 1, size=(len(cells), 3))
+        
+        landcover = gpd.GeoDataFrame({
+            'geometry': cells,
+            'landcover_type': landcover_types[type_idx.ravel()],
+            'urban_density': draws[:, 0],
+            'vegetation_cover': draws[:, 1],
+            'water_bodies': draws[:, 2] * 0.3
+        }, crs='EPSG:4326')
+    
+    # Build the STRtree now so the landcover join queries it straight away
+    landcover.sindex
     
     print(f"Loaded {len(landcover)} landcover polygons")
     return landcover
@@ -164,68 +196,34 @@ def spatial_temporal_join(weather_df, incidents_df, landcover_gdf):
     """
     print("Performing spatial and temporal joins...")
     
-    # Convert weather data to GeoDataFrame
-    weather_gdf = gpd.GeoDataFrame(
-        weather_df,
-        geometry=gpd.points_from_xy(
-            [12.9716] * len(weather_df),  # Bangalore center lat
-            [77.5946] * len(weather_df)   # Bangalore center lon
-        ),
-        crs='EPSG:4326'
-    )
-    
-    # Convert incidents to GeoDataFrame
-    incidents_gdf = gpd.GeoDataFrame(
-        incidents_df,
-        geometry=gpd.points_from_xy(incidents_df['lon'], incidents_df['lat']),
-        crs='EPSG:4326'
-    )
-    
-    # Spatial join: incidents to nearest weather point
-    print("Joining incidents to weather data...")
-    incidents_weather = gpd.sjoin_nearest(
-        incidents_gdf, 
-        weather_gdf[['geometry', 'time', 'temp', 'tavg', 'tmin', 'prcp', 
-                    'temp_roll3', 'tavg_roll3', 'tmin_roll3']], 
-        how='left', 
-        distance_col='weather_dist'
-    )
-    
-    # Drop the index_right column that was created by sjoin_nearest
-    if 'index_right' in incidents_weather.columns:
-        incidents_weather = incidents_weather.drop(columns=['index_right'])
-    
-    # Reset index to avoid any conflicts
-    incidents_weather = incidents_weather.reset_index(drop=True)
-    
-    # Spatial join: incidents to landcover
+    # Spatial join: incidents to landcover. One bulk STRtree query over the
+    # incident points returns (point, polygon) index pairs; incidents without
+    # a hit are kept with empty landcover attributes, as in a left sjoin.
+    # Done before the weather join so each incident is tested only once.
     print("Joining incidents to landcover data...")
-    incidents_landcover = gpd.sjoin(
-        incidents_weather, 
-        landcover_gdf, 
-        how='left', 
-        predicate='intersects'
+    points = shapely.points(incidents_df['lon'].to_numpy(), incidents_df['lat'].to_numpy())
+    point_idx, poly_idx = landcover_gdf.sindex.query(points, predicate='intersects')
+    unmatched = np.setdiff1d(np.arange(len(incidents_df)), point_idx)
+    point_idx = np.concatenate([point_idx, unmatched])
+    poly_idx = np.concatenate([poly_idx, np.full(len(unmatched), -1)])
+    order = np.argsort(point_idx, kind='stable')
+    
+    landcover_attrs = pd.DataFrame(landcover_gdf.drop(columns='geometry')).reset_index(drop=True)
+    incidents_landcover = (
+        incidents_df.iloc[point_idx[order]].reset_index(drop=True)
+        .join(landcover_attrs.reindex(poly_idx[order]).reset_index(drop=True),
+              lsuffix='_left', rsuffix='_right')
     )
     
-    # Drop the index_right column from the second join
-    if 'index_right' in incidents_landcover.columns:
-        incidents_landcover = incidents_landcover.drop(columns=['index_right'])
-    
-    # Reset index again
-    incidents_landcover = incidents_landcover.reset_index(drop=True)
-    
-    # Temporal join: floor timestamps to day for better matching
-    incidents_landcover['date'] = incidents_landcover['timestamp'].dt.floor('D')
-    weather_gdf['date'] = weather_gdf['time'].dt.floor('D')
-    
-    # Merge on date
-    final_df = pd.merge(
-        incidents_landcover,
-        weather_gdf[['date', 'temp', 'tavg', 'tmin', 'prcp', 
+    # Join incidents to weather data. The weather series has no coordinates of
+    # its own (every reading sits at the Bangalore centre), so all readings are
+    # tied as the nearest point to every incident and a nearest-neighbour join
+    # reduces to a cross join - no spatial index needed.
+    print("Joining incidents to weather data...")
+    final_df = incidents_landcover.merge(
+        weather_df[['time', 'temp', 'tavg', 'tmin', 'prcp',
                     'temp_roll3', 'tavg_roll3', 'tmin_roll3']],
-        on='date',
-        how='left',
-        suffixes=('', '_weather')
+        how='cross'
     )
     
     print(f"Spatial-temporal join completed. Final dataset has {len(final_df)} records")
@@ -250,20 +248,19 @@ def add_temporal_features(df):
     if 'timestamp' in df.columns:
         df['hour'] = df['timestamp'].dt.hour
     
-    # Add season
-    df['season'] = df['month'].map({
-        12: 'winter', 1: 'winter', 2: 'winter',
-        3: 'spring', 4: 'spring', 5: 'spring',
-        6: 'summer', 7: 'summer', 8: 'summer',
-        9: 'autumn', 10: 'autumn', 11: 'autumn'
-    })
+    # Add season via a month -> code lookup (index 0 is unused)
+    season_codes = np.array([-1, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0], dtype=np.int8)
+    df['season'] = pd.Categorical.from_codes(
+        season_codes[df['month'].to_numpy()],
+        categories=['winter', 'spring', 'summer', 'autumn']
+    )
     
     print("Temporal features added successfully")
     return df
 
 def clean_and_export_features(df, output_path):
     """
-    Clean the dataset and export to CSV
+    Clean the dataset and export to Parquet (or CSV for a .csv output path)
     """
     print("Cleaning and preparing final features...")
     
@@ -280,16 +277,27 @@ def clean_and_export_features(df, output_path):
     available_columns = [col for col in feature_columns if col in df.columns]
     final_features = df[available_columns].copy()
     
+    # Store string labels as categoricals (int8 codes instead of objects)
+    for col in ['incident_type', 'landcover_type']:
+        if col in final_features.columns:
+            final_features[col] = final_features[col].astype('category')
+    
     # Handle missing values
-    numeric_columns = final_features.select_dtypes(include=[np.number]).columns
-    final_features[numeric_columns] = final_features[numeric_columns].fillna(final_features[numeric_columns].mean())
+    numeric_columns = [col for col in available_columns if col in NUMERIC_COLS]
+    numeric_features = final_features[numeric_columns]
+    final_features[numeric_columns] = numeric_features.fillna(numeric_features.mean())
     
     # Drop rows with missing categorical data
-    categorical_columns = final_features.select_dtypes(include=['object']).columns
+    categorical_columns = [col for col in available_columns if col in CATEG_COLS]
     final_features = final_features.dropna(subset=categorical_columns)
     
-    # Export to CSV
-    final_features.to_csv(output_path, index=False)
+    # Export to Parquet: typed, compressed and dictionary-encoded, so loaders
+    # skip text parsing and keep the categorical dtypes
+    if output_path.endswith('.csv'):
+        final_features.to_csv(output_path, index=False)
+    else:
+        final_features.to_parquet(output_path, engine='pyarrow', compression='snappy',
+                                  index=False, use_dictionary=True)
     
     print(f"Features exported to {output_path}")
     print(f"Final dataset: {len(final_features)} rows, {len(final_features.columns)} columns")
@@ -310,8 +318,8 @@ def main():
                         help="Path to incidents JSON/CSV file (optional)")
     parser.add_argument("--landcover", default=None,
                         help="Path to landcover GeoJSON file (optional)")
-    parser.add_argument("--output", default="features.csv",
-                        help="Output CSV file for features")
+    parser.add_argument("--output", default="features.parquet",
+                        help="Output Parquet (or .csv) file for features")
     
     args = parser.parse_args()
     
@@ -0,0 +1,43 @@
+"""
+Compiled feature kernels shared by the training scripts.
+
+Kernels are compiled eagerly for a fixed signature with cache=True, so the
+machine code is written next to this module on first use and loaded from
+disk on every later run instead of being JIT-compiled at each script start.
+"""
+
+import numpy as np
+from numba import njit, prange, types
+
+# Inputs are declared read-only so views of pandas columns can be passed
+# without a copy
+_F8_IN = types.Array(types.float64, 1, 'A', readonly=True)
+
+# Row order of the compute_derived output
+DERIVED_FEATURES = [
+    'temp_humidity_interaction', 'temp_range', 'heat_index',
+    'distance_from_center', 'green_urban_ratio', 'water_availability'
+]
+
+
+@njit(
+    types.void(_F8_IN, _F8_IN, _F8_IN, _F8_IN, _F8_IN, _F8_IN, _F8_IN, _F8_IN,
+               types.float64[:, :]),
+    parallel=True,
+    fastmath=True,
+    cache=True,
+)
+def compute_derived(lat, lon, temp, tmin, tavg, veg, urban, water, out):
+    """Fill the weather, geographic and environmental features in one pass.
+
+    ``out`` has one row per entry of DERIVED_FEATURES.
+    """
+    for i in prange(lat.shape[0]):
+        dx = lat[i] - 12.9716
+        dy = lon[i] - 77.5946
+        out[0, i] = temp[i] * tavg[i]
+        out[1, i] = temp[i] - tmin[i]
+        out[2, i] = temp[i] + 0.5 * tavg[i]
+        out[3, i] = np.sqrt(dx * dx + dy * dy)
+        out[4, i] = veg[i] / (urban[i] + 0.1)
+        out[5, i] = water[i] + veg[i]
@@ -0,0 +1,26 @@
+"""
+Shared loader for the prepared features used by the training scripts.
+
+features.parquet is the working copy. When features.csv is newer (e.g. after
+``data_preparation.py --output features.csv``) or the Parquet file is missing,
+the CSV is converted once with the multi-threaded PyArrow parser, so every
+script reads the same, current data.
+"""
+
+import os
+
+import pandas as pd
+
+CSV_PATH = 'features.csv'
+PARQUET_PATH = 'features.parquet'
+
+
+def read_features(columns=None, csv_path=CSV_PATH, parquet_path=PARQUET_PATH):
+    """Load the prepared features (optionally only ``columns``) from Parquet"""
+    if os.path.exists(csv_path) and (
+        not os.path.exists(parquet_path)
+        or os.path.getmtime(csv_path) > os.path.getmtime(parquet_path)
+    ):
+        print(f"Converting {csv_path} to {parquet_path}")
+        pd.read_csv(csv_path, engine='pyarrow').to_parquet(parquet_path, compression='zstd')
+    return pd.read_parquet(parquet_path, columns=columns)
@@ -14,11 +14,13 @@ import numpy as np
 from datetime import datetime, timedelta
 import warnings
 import os
+import shutil
+import bottleneck as bn
 warnings.filterwarnings('ignore')
 
 # Machine learning libraries
 from sklearn.model_selection import train_test_split, GridSearchCV, cross_val_score, StratifiedKFold
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, VotingClassifier
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier, VotingClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import (
     classification_report, confusion_matrix, roc_auc_score, 
@@ -26,8 +28,11 @@ from sklearn.metrics import (
 )
 from sklearn.preprocessing import LabelEncoder, StandardScaler, RobustScaler
 from sklearn.pipeline import Pipeline
+from sklearn.base import clone
+from sklearn.utils import Bunch
+from sklearn.neighbors import NearestNeighbors
 from sklearn.utils.class_weight import compute_class_weight
-from imblearn.over_sampling import SMOTE
+from imblearn.over_sampling import BorderlineSMOTE
 from imblearn.under_sampling import RandomUnderSampler
 from imblearn.pipeline import Pipeline as ImbPipeline
 
@@ -36,16 +41,42 @@ import xgboost as xgb
 
 # Model serialization
 import joblib
+from joblib import Parallel, delayed
+
+# Precompiled feature kernels
+from feature_kernels import DERIVED_FEATURES, compute_derived
+from feature_store import read_features
 
 # Set random seed for reproducibility
 np.random.seed(42)
 
+# XGBoost device: "cuda" builds histograms on the GPU. Defaults to the GPU when
+# one is visible; override with XGB_DEVICE=cpu or XGB_DEVICE=cuda
+XGB_DEVICE = os.environ.get('XGB_DEVICE', 'cuda' if shutil.which('nvidia-smi') else 'cpu')
+
+# On-disk cache for deterministic intermediate steps. Entries are keyed on the
+# decorated function's own source and a hash of its arguments; code it calls
+# into is not tracked, so only self-contained steps are cached (clear .cache/
+# after upgrading pandas or imbalanced-learn)
+memory = joblib.Memory('.cache', verbose=0)
+
+# Columns of the prepared features used downstream
+USECOLS = [
+    'timestamp', 'incident_type',
+    'temp', 'tavg', 'tmin', 'prcp',
+    'temp_roll3', 'tavg_roll3', 'tmin_roll3',
+    'dayofweek', 'month', 'dayofyear',
+    'urban_density', 'vegetation_cover', 'water_bodies',
+    'lat', 'lon', 'season', 'landcover_type'
+]
+
 def load_and_explore_data():
     """Load and explore the prepared features"""
     print("=== Loading and Exploring Data ===")
     
-    # Load the prepared features
-    df = pd.read_csv('features.csv')
+    # Load the prepared features (Parquet, refreshed from a newer
+    # features.csv); only the columns the model uses are read
+    df = read_features(columns=USECOLS)
     
     print(f"Dataset shape: {df.shape}")
     print(f"Date range: {df['timestamp'].min()} to {df['timestamp'].max()}")
@@ -66,29 +97,37 @@ def enhanced_feature_engineering(df):
     
     # Enhanced temporal features
     df['hour'] = df['timestamp'].dt.hour
-    df['is_weekend'] = df['dayofweek'].isin([5, 6]).astype(int)
-    df['is_peak_hours'] = df['hour'].isin([10, 11, 12, 13, 14, 15, 16, 17]).astype(int)
-    
-    # Weather interaction features
-    df['temp_humidity_interaction'] = df['temp'] * df['tavg']  # Temperature interaction
-    df['temp_range'] = df['temp'] - df['tmin']  # Temperature range
-    df['heat_index'] = df['temp'] + 0.5 * df['tavg']  # Simple heat index
-    
-    # Rolling features with different windows
-    df['temp_roll7'] = df['temp'].rolling(window=7, min_periods=1).mean()
-    df['tavg_roll7'] = df['tavg'].rolling(window=7, min_periods=1).mean()
-    df['temp_std_roll3'] = df['temp'].rolling(window=3, min_periods=1).std()
+    # Flags are range comparisons stored as uint8 views of the boolean masks
+    hour = df['hour'].to_numpy()
+    dow = df['dayofweek'].to_numpy()
+    month = df['month'].to_numpy()
+    df['is_weekend'] = (dow >= 5).view(np.uint8)
+    df['is_peak_hours'] = ((hour >= 10) & (hour <= 17)).view(np.uint8)
+    
+    # Rolling features with different windows (bottleneck's moving-window
+    # kernels work on the raw arrays, skipping pandas' Rolling machinery).
+    # The ddof=1 std needs two values per window, like pandas' NaN for one
+    temp = df['temp'].to_numpy(dtype=np.float64)
+    tavg = df['tavg'].to_numpy(dtype=np.float64)
+    df['temp_roll7'] = bn.move_mean(temp, window=7, min_count=1)
+    df['tavg_roll7'] = bn.move_mean(tavg, window=7, min_count=1)
+    df['temp_std_roll3'] = bn.move_std(temp, window=3, min_count=2, ddof=1)
     
     # Seasonal features
-    df['is_summer'] = df['month'].isin([3, 4, 5, 6]).astype(int)
-    df['is_monsoon'] = df['month'].isin([6, 7, 8, 9]).astype(int)
-    
-    # Geographic features
-    df['distance_from_center'] = np.sqrt((df['lat'] - 12.9716)**2 + (df['lon'] - 77.5946)**2)
-    
-    # Environmental features
-    df['green_urban_ratio'] = df['vegetation_cover'] / (df['urban_density'] + 0.1)
-    df['water_availability'] = df['water_bodies'] + df['vegetation_cover']
+    df['is_summer'] = ((month >= 3) & (month <= 6)).view(np.uint8)
+    df['is_monsoon'] = ((month >= 6) & (month <= 9)).view(np.uint8)
+    
+    # Weather interaction, geographic and environmental features, computed
+    # in a single fused pass instead of one temporary array per expression
+    out = np.empty((len(DERIVED_FEATURES), len(df)))
+    compute_derived(
+        *(df[col].to_numpy(dtype=np.float64) for col in
+          ['lat', 'lon', 'temp', 'tmin', 'tavg',
+           'vegetation_cover', 'urban_density', 'water_bodies']),
+        out
+    )
+    for name, values in zip(DERIVED_FEATURES, out):
+        df[name] = values
     
     print(f"Enhanced features added. New shape: {df.shape}")
     print(f"New features: {[col for col in df.columns if col not in ['timestamp', 'incident_type', 'severity', 'description']]}")
@@ -118,9 +157,12 @@ def split_data_by_date(df):
     print(f"Max date in dataset: {max_date}")
     print(f"Split date (3 months ago): {split_date}")
     
-    # Split the data
-    train_df = df[df['timestamp'] <= split_date].copy()
-    test_df = df[df['timestamp'] > split_date].copy()
+    # Split the data: with rows in time order the split is a single binary
+    # search and two contiguous slices, no boolean masks or copies
+    df = df.sort_values('timestamp', kind='mergesort').reset_index(drop=True)
+    split_idx = df['timestamp'].searchsorted(split_date, side='right')
+    train_df = df.iloc[:split_idx]
+    test_df = df.iloc[split_idx:]
     
     print(f"Training set: {len(train_df):,} records ({len(train_df)/len(df)*100:.1f}%)")
     print(f"Test set: {len(test_df):,} records ({len(test_df)/len(df)*100:.1f}%)")
@@ -133,6 +175,20 @@ def prepare_enhanced_features(train_df, test_df):
     """Prepare enhanced features for modeling"""
     print("\n=== Preparing Enhanced Features ===")
     
+    # The work is cached; the summary is printed here so it also appears on
+    # a cache hit
+    X_train, X_test, y_train_binary, y_test_binary, encoders = _encode_enhanced_features(train_df, test_df)
+    
+    for feature, value_to_int in encoders.items():
+        print(f"Encoded {feature}: {len(value_to_int)} unique values")
+    print(f"Enhanced feature matrix shape - Train: {X_train.shape}, Test: {X_test.shape}")
+    print(f"Features used: {list(X_train.columns)}")
+    
+    return X_train, X_test, y_train_binary, y_test_binary, encoders
+
+@memory.cache
+def _encode_enhanced_features(train_df, test_df):
+    """Feature selection, imputation and categorical encoding (cached)"""
     # Select enhanced features for modeling
     feature_columns = [
         'temp', 'tavg', 'tmin', 'prcp',
@@ -150,9 +206,10 @@ def prepare_enhanced_features(train_df, test_df):
     # Categorical features to encode
     categorical_features = ['season', 'landcover_type']
     
-    # Prepare features
-    X_train = train_df[feature_columns].copy()
-    X_test = test_df[feature_columns].copy()
+    # Prepare features. Column selection already yields new frames (lazily
+    # copied under copy-on-write), so no explicit .copy() is needed
+    X_train = train_df[feature_columns]
+    X_test = test_df[feature_columns]
     
     # Handle missing values
     X_train = X_train.fillna(X_train.mean())
@@ -163,31 +220,56 @@ def prepare_enhanced_features(train_df, test_df):
     for feature in categorical_features:
         if feature in train_df.columns:
             # Get all unique values from both train and test
-            all_values = pd.concat([train_df[feature], test_df[feature]]).unique()
+            all_values = pd.concat([train_df[feature], test_df[feature]]).dropna().unique()
             
             # Create a mapping dictionary
             value_to_int = {val: idx for idx, val in enumerate(all_values)}
             
-            # Apply encoding
-            X_train[f'{feature}_encoded'] = train_df[feature].map(value_to_int)
-            X_test[f'{feature}_encoded'] = test_df[feature].map(value_to_int)
+            # Apply encoding: Categorical codes do the lookup in C. Missing
+            # values (code -1) get their own slot after the known categories,
+            # since XGBoost rejects negative categorical codes
+            missing_code = len(all_values)
+            for X, split_df in ((X_train, train_df), (X_test, test_df)):
+                codes = pd.Categorical(split_df[feature], categories=all_values).codes
+                X[f'{feature}_encoded'] = np.where(codes < 0, missing_code, codes.astype(np.int32))
             
             # Store the mapping for later use
             encoders[feature] = value_to_int
-            
-            print(f"Encoded {feature}: {len(all_values)} unique values")
     
     # Prepare targets
     y_train_binary = train_df['hazard_binary']
     y_test_binary = test_df['hazard_binary']
     
-    print(f"Enhanced feature matrix shape - Train: {X_train.shape}, Test: {X_test.shape}")
-    print(f"Features used: {list(X_train.columns)}")
-    
     return X_train, X_test, y_train_binary, y_test_binary, encoders
 
-def handle_class_imbalance(X_train, y_train):
-    """Handle class imbalance using SMOTE"""
+@memory.cache
+def _smote_resample(X_train, y_train):
+    """Borderline-SMOTE oversampling, cached on the training data
+
+    Only minority samples near the class boundary are used as seeds. The
+    neighbour searches are passed in as NearestNeighbors estimators (n + 1
+    neighbours, since each sample finds itself) so they run on all cores.
+    """
+    smote = BorderlineSMOTE(
+        random_state=42, kind='borderline-1',
+        k_neighbors=NearestNeighbors(n_neighbors=4, n_jobs=-1),
+        m_neighbors=NearestNeighbors(n_neighbors=11, n_jobs=-1)
+    )
+    X_resampled, y_resampled = smote.fit_resample(X_train, y_train)
+    
+    # Synthetic rows interpolate between neighbours; snap the category codes
+    # back to valid integers
+    encoded = [col for col in X_resampled.columns if col.endswith('_encoded')]
+    X_resampled[encoded] = X_resampled[encoded].round()
+    return X_resampled, y_resampled
+
+def handle_class_imbalance(X_train, y_train, resample=False):
+    """Handle class imbalance with class weights, optionally adding SMOTE
+
+    Every model is already trained with balanced class weights (or a data
+    derived scale_pos_weight), so SMOTE is off by default: it doubles the
+    rows every model has to fit on.
+    """
     print("\n=== Handling Class Imbalance ===")
     
     # Calculate class weights
@@ -197,47 +279,85 @@ def handle_class_imbalance(X_train, y_train):
     print(f"Original class distribution: {np.bincount(y_train)}")
     print(f"Class weights: {weight_dict}")
     
+    if not resample:
+        return X_train, y_train, weight_dict
+    
     # Apply SMOTE for oversampling
-    smote = SMOTE(random_state=42, k_neighbors=3)
-    X_train_balanced, y_train_balanced = smote.fit_resample(X_train, y_train)
+    X_train_balanced, y_train_balanced = _smote_resample(X_train, y_train)
     
     print(f"Balanced class distribution: {np.bincount(y_train_balanced)}")
     
     return X_train_balanced, y_train_balanced, weight_dict
 
+def _fit_model(name, model, X_train, y_train):
+    """Fit a single model; runs in a joblib worker"""
+    print(f"Training {name}...")
+    model.fit(X_train, y_train)
+    print(f"✅ {name} trained successfully")
+    return name, model
+
 def train_ensemble_models(X_train, y_train, class_weights):
     """Train ensemble models with class weights"""
     print("\n=== Training Ensemble Models ===")
     
+    # Ratio of negatives to positives for XGBoost
+    scale_pos_weight = (y_train == 0).sum() / (y_train == 1).sum()
+    
+    # The four models train side by side, so each gets an even share of the
+    # cores for its own threads instead of all of them
+    n_workers = 4
+    inner_jobs = max(1, (os.cpu_count() or 1) // n_workers)
+    
+    # XGBoost splits the integer-coded categoricals natively (partitioning
+    # the codes) instead of treating them as ordered numbers
+    feature_types = ['c' if col.endswith('_encoded') else 'q' for col in X_train.columns]
+    
     # Define models with class weights
     models = {
         'Random Forest': RandomForestClassifier(
             n_estimators=200, max_depth=15, min_samples_split=5,
-            min_samples_leaf=2, random_state=42, class_weight='balanced'
+            min_samples_leaf=2, random_state=42, class_weight='balanced',
+            n_jobs=inner_jobs
         ),
         'XGBoost': xgb.XGBClassifier(
             n_estimators=200, max_depth=6, learning_rate=0.1,
-            subsample=0.8, random_state=42, scale_pos_weight=3.0
+            subsample=0.8, random_state=42, scale_pos_weight=scale_pos_weight,
+            tree_method='hist', device=XGB_DEVICE, n_jobs=inner_jobs,
+            enable_categorical=True, feature_types=feature_types
         ),
-        'Gradient Boosting': GradientBoostingClassifier(
-            n_estimators=200, max_depth=6, learning_rate=0.1,
-            random_state=42
+        'HistGBM': HistGradientBoostingClassifier(
+            max_iter=200, max_depth=8, learning_rate=0.1,
+            class_weight='balanced', random_state=42
         ),
         'Logistic Regression': LogisticRegression(
             C=1.0, random_state=42, class_weight='balanced', max_iter=1000
         )
     }
     
-    # Train all models
-    trained_models = {}
-    for name, model in models.items():
-        print(f"Training {name}...")
-        model.fit(X_train, y_train)
-        trained_models[name] = model
-        print(f"✅ {name} trained successfully")
+    # Train all models side by side, one worker per model. joblib caps the
+    # OpenMP pools (HistGBM) of each worker to the same share
+    trained_models = dict(Parallel(n_jobs=n_workers, backend='loky')(
+        delayed(_fit_model)(name, clone(model), X_train, y_train)
+        for name, model in models.items()
+    ))
     
     return trained_models
 
+def predict_proba_chunked(model, X, chunk_size=100_000):
+    """predict_proba over row chunks to bound the model's temporary arrays
+
+    The output is still one (n_rows, n_classes) array so metrics stay exact,
+    but intermediates (e.g. each ensemble member's probabilities) are only
+    ever chunk-sized.
+    """
+    if len(X) <= chunk_size:
+        return model.predict_proba(X)
+    
+    proba = np.empty((len(X), len(model.classes_)))
+    for start in range(0, len(X), chunk_size):
+        proba[start:start + chunk_size] = model.predict_proba(X.iloc[start:start + chunk_size])
+    return proba
+
 def evaluate_models_comprehensive(models, X_test, y_test):
     """Comprehensive model evaluation"""
     print("\n=== Comprehensive Model Evaluation ===")
@@ -247,9 +367,10 @@ def evaluate_models_comprehensive(models, X_test, y_test):
     for name, model in models.items():
         print(f"\n--- {name} Evaluation ---")
         
-        # Predictions
-        y_pred = model.predict(X_test)
-        y_pred_proba = model.predict_proba(X_test)[:, 1]
+        # Predictions: one predict_proba pass, labels taken from its argmax
+        proba = predict_proba_chunked(model, X_test)
+        y_pred = model.classes_[proba.argmax(axis=1)]
+        y_pred_proba = proba[:, 1]
         
         # Comprehensive metrics
         accuracy = accuracy_score(y_test, y_pred)
@@ -281,7 +402,7 @@ def evaluate_models_comprehensive(models, X_test, y_test):
     return results
 
 def create_ensemble_model(models, X_train, y_train):
-    """Create voting ensemble from best models"""
+    """Create voting ensemble from the already-trained models"""
     print("\n=== Creating Ensemble Model ===")
     
     # Select best models for ensemble
@@ -296,7 +417,12 @@ def create_ensemble_model(models, X_train, y_train):
         voting='soft'
     )
     
-    ensemble.fit(X_train, y_train)
+    # The base models are already fitted on the same data, so set the fitted
+    # state directly instead of calling fit(), which would retrain each one
+    ensemble.estimators_ = [model for _, model in best_models]
+    ensemble.named_estimators_ = Bunch(**dict(best_models))
+    ensemble.le_ = LabelEncoder().fit(y_train)
+    ensemble.classes_ = ensemble.le_.classes_
     print(f"✅ Ensemble model created with {len(best_models)} models")
     
     return ensemble
@@ -366,6 +492,11 @@ def main():
     # Step 5: Prepare enhanced features
     X_train, X_test, y_train_binary, y_test_binary, encoders = prepare_enhanced_features(train_df, test_df)
     
+    # float32 halves the bytes scanned by the tree/histogram builders; SMOTE
+    # keeps the dtype, so the resampled matrix stays float32 as well
+    X_train = X_train.astype(np.float32)
+    X_test = X_test.astype(np.float32)
+    
     # Step 6: Handle class imbalance
     X_train_balanced, y_train_balanced, class_weights = handle_class_imbalance(X_train, y_train_binary)
     
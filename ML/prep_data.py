@@ -14,24 +14,66 @@ NOTE: Place all required weather CSVs for Bangalore in the --weather_dir folder.
 """
 
 import argparse
+import hashlib
 import os
+import pickle
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import geopandas as gpd
 import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import shapely
+from numba import njit, prange
+from scipy.spatial import cKDTree
 from shapely.geometry import Point
 
+HOUR_NS = 3_600_000_000_000
+# Pickled KD-trees over the weather stations (see load_or_build_kdtree)
+KDTREE_CACHE_DIR = '.cache'
+
 def load_weather_data(weather_dir):
-    dfs = []
-    for fname in os.listdir(weather_dir):
-        if fname.endswith(".csv"):
-            dfs.append(pd.read_csv(os.path.join(weather_dir, fname)))
-    all_weather = pd.concat(dfs, ignore_index=True)
-    print(f"Loaded {len(all_weather)} weather records from {len(dfs)} CSV files.")
+    # Parse the files concurrently with Arrow's CSV reader (which releases the
+    # GIL) and concatenate the tables (promoting types that differ between
+    # files) before a single conversion to pandas
+    paths = [os.path.join(weather_dir, fname) for fname in os.listdir(weather_dir)
+             if fname.endswith(".csv")]
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(paths)))) as pool:
+        tables = list(pool.map(pacsv.read_csv, paths))
+    all_weather = pa.concat_tables(tables, promote_options="permissive").to_pandas()
+    # float32 is ample for these readings and halves the bytes every later
+    # pass (rolling, as-of gather) touches
+    for col in ('temp', 'humidity', 'wind'):
+        all_weather[col] = pd.to_numeric(all_weather[col], downcast='float')
+    print(f"Loaded {len(all_weather)} weather records from {len(tables)} CSV files.")
     return all_weather
 
+def epoch_unit(values):
+    """Unit of numeric epoch timestamps, from the size of the largest value.
+
+    Each step up is a factor of 1000; the cut-offs put any date between 1973
+    and 5138 in the right unit.
+    """
+    largest = np.nanmax(np.abs(np.asarray(values, dtype=np.float64)), initial=0.0)
+    for unit, limit in (('s', 1e11), ('ms', 1e14), ('us', 1e17)):
+        if largest < limit:
+            return unit
+    return 'ns'
+
 def load_incidents(incidents_path):
     if incidents_path.endswith(".json"):
-        df = pd.read_json(incidents_path)
+        # orjson parses the raw bytes; the records (or column mapping) go
+        # straight to the DataFrame constructor without read_json's inference
+        with open(incidents_path, 'rb') as f:
+            df = pd.DataFrame(orjson.loads(f.read()))
+        # Epoch timestamps: the unit (s/ms/us/ns) follows from the magnitude,
+        # as in pd.read_json
+        if pd.api.types.is_numeric_dtype(df['timestamp']):
+            df['timestamp'] = pd.to_datetime(df['timestamp'], unit=epoch_unit(df['timestamp']))
+        else:
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
     elif incidents_path.endswith(".csv"):
         df = pd.read_csv(incidents_path)
     else:
@@ -44,42 +86,166 @@ def load_landcover(landcover_path):
     print(f"Loaded {len(gdf)} landcover polygons from {landcover_path}.")
     return gdf
 
+def load_or_build_kdtree(xy, cache_dir=KDTREE_CACHE_DIR):
+    """cKDTree over the (n, 2) point array, cached as a pickle in cache_dir.
+
+    The weather stations are the same across runs, so the file is keyed by a
+    hash of the coordinates and a rerun on the same grid skips the tree build.
+    The cache directory and files are created private to the current user;
+    a file that cannot be read or holds a different tree is rebuilt.
+    """
+    xy = np.ascontiguousarray(xy)
+    key = hashlib.sha256(xy.tobytes()).hexdigest()[:16]
+    path = os.path.join(cache_dir, f"kdtree_{key}.pkl")
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                tree = pickle.load(f)
+            if isinstance(tree, cKDTree) and np.array_equal(tree.data, xy):
+                return tree
+            print(f"Ignoring KD-tree cache {path}: it holds a different tree")
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+            print(f"Ignoring unreadable KD-tree cache {path}: {e}")
+    tree = cKDTree(xy)
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        # mkstemp creates the file with mode 0600; the rename makes it
+        # visible only once fully written
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not write KD-tree cache {path}: {e}")
+    return tree
+
+@njit(cache=True)
+def asof_backward(left_keys, right_keys, right_vals):
+    """Backward as-of join of two sorted int64 key arrays in a single pass.
+
+    Row i of the result is the right_vals row of the last right key <= left_keys[i]
+    (NaN when there is none), matching pd.merge_asof(direction='backward').
+    """
+    out = np.full((left_keys.shape[0], right_vals.shape[1]), np.nan, dtype=right_vals.dtype)
+    j = -1
+    for i in range(left_keys.shape[0]):
+        while j + 1 < right_keys.shape[0] and right_keys[j + 1] <= left_keys[i]:
+            j += 1
+        if j >= 0:
+            out[i, :] = right_vals[j, :]
+    return out
+
+@njit(parallel=True, nogil=True, cache=True)
+def rolling_mean_rows(series, window):
+    """Trailing mean over `window` samples for each row of a (k, n) array.
+
+    NaNs are skipped, matching pandas rolling(window, min_periods=1).mean().
+    Each series is one running-sum pass, and the series run in parallel.
+    Sums are accumulated in float64 whatever the input dtype.
+    """
+    out = np.empty_like(series)
+    for k in prange(series.shape[0]):
+        total = 0.0
+        count = 0
+        for i in range(series.shape[1]):
+            x = series[k, i]
+            if not np.isnan(x):
+                total += x
+                count += 1
+            if i >= window:
+                x = series[k, i - window]
+                if not np.isnan(x):
+                    total -= x
+                    count -= 1
+            out[k, i] = total / count if count > 0 else np.nan
+    return out
+
 def preprocess(weather, incidents, landcover):
     weather['timestamp'] = pd.to_datetime(weather['timestamp'])
     incidents['timestamp'] = pd.to_datetime(incidents['timestamp'])
 
-    weather_gdf = gpd.GeoDataFrame(
-        weather,
-        geometry=gpd.points_from_xy(weather['lon'], weather['lat']),
-        crs='EPSG:4326'
-    )
-    incidents_gdf = gpd.GeoDataFrame(
-        incidents,
-        geometry=gpd.points_from_xy(incidents['lon'], incidents['lat']),
-        crs='EPSG:4326'
-    )
     print("Joining incidents to nearest weather grid point...")
-    incidents_gdf = incidents_gdf.sjoin_nearest(weather_gdf[['geometry', 'timestamp', 'temp', 'humidity', 'wind']], how='left', distance_col='weather_dist', max_distance=0.05)
+    # One batched KD-tree query over the distinct (lon, lat) stations; incidents
+    # with no station within 0.05 degrees come back with idx == len(stations)
+    weather_xy = np.column_stack([weather['lon'].to_numpy(), weather['lat'].to_numpy()])
+    stations, station_of_row = np.unique(weather_xy, axis=0, return_inverse=True)
+    incident_xy = np.column_stack([incidents['lon'].to_numpy(), incidents['lat'].to_numpy()])
+    dist, idx = load_or_build_kdtree(stations).query(incident_xy, k=1, distance_upper_bound=0.05)
+    matched = idx < len(stations)
+    # Each incident takes its station's latest reading at or before the
+    # incident time (NaN when there is none, as for the rolling means below)
+    incident_ns = incidents['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    weather_ns = weather['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    left = pd.DataFrame({'ts': incident_ns, 'station': np.where(matched, idx, -1),
+                         'row': np.arange(len(incidents))}).sort_values('ts', kind='mergesort')
+    right = pd.DataFrame({'ts': weather_ns, 'station': station_of_row.ravel(),
+                          'weather_row': np.arange(len(weather))}).sort_values('ts', kind='mergesort')
+    reading = pd.merge_asof(left, right, on='ts', by='station', direction='backward')
+    weather_row = np.full(len(incidents), -1)
+    weather_row[reading['row'].to_numpy()] = reading['weather_row'].fillna(-1).to_numpy(dtype=np.int64)
+    has_reading = weather_row >= 0
+    weather_vals = weather[['temp', 'humidity', 'wind']].to_numpy()
+    nearest = np.full((len(incidents), 3), np.nan, dtype=weather_vals.dtype)
+    nearest[has_reading] = weather_vals[weather_row[has_reading]]
+    incidents[['temp', 'humidity', 'wind']] = nearest
+    incidents['weather_dist'] = np.where(matched, dist, np.nan)
+
     print("Joining incidents to landcover polygons...")
-    incidents_gdf = gpd.sjoin(incidents_gdf, landcover, how='left', predicate='intersects')
-    weather = weather.sort_values('timestamp')
-    weather['temp_roll3'] = weather['temp'].rolling(window=72, min_periods=1).mean()
-    weather['humidity_roll3'] = weather['humidity'].rolling(window=72, min_periods=1).mean()
-    weather['wind_roll3'] = weather['wind'].rolling(window=72, min_periods=1).mean()
-    incidents_gdf['incident_hour'] = incidents_gdf['timestamp'].dt.floor('H')
-    weather['weather_hour'] = weather['timestamp'].dt.floor('H')
-    merged = pd.merge_asof(
-        incidents_gdf.sort_values('incident_hour'),
-        weather[['weather_hour', 'temp_roll3', 'humidity_roll3', 'wind_roll3']].sort_values('weather_hour'),
-        left_on='incident_hour', right_on='weather_hour', direction='backward'
+    # One bulk STRtree query over all incident points returns (point, polygon)
+    # index pairs; incidents without a hit are kept with empty landcover
+    # attributes, as in a left sjoin. The points are a bare shapely array built
+    # in one vectorised call; incidents stay a plain DataFrame
+    points = shapely.points(incidents['lon'].to_numpy(), incidents['lat'].to_numpy())
+    point_idx, poly_idx = landcover.sindex.query(points, predicate='intersects')
+    unmatched = np.setdiff1d(np.arange(len(incidents)), point_idx)
+    point_idx = np.concatenate([point_idx, unmatched])
+    poly_idx = np.concatenate([poly_idx, np.full(len(unmatched), -1)])
+    order = np.argsort(point_idx, kind='stable')
+    point_idx, poly_idx = point_idx[order], poly_idx[order]
+    # Rows are only repeated when a point falls in several polygons
+    if len(point_idx) == len(incidents):
+        incidents = incidents.reset_index(drop=True)
+    else:
+        incidents = incidents.iloc[point_idx].reset_index(drop=True)
+    # Gather each landcover attribute straight from its array by polygon index
+    # (-1 -> missing), keeping the _left/_right names for clashing columns
+    attr_cols = landcover.columns.drop('geometry', errors='ignore')
+    clashes = attr_cols.intersection(incidents.columns)
+    landcover_attrs = pd.DataFrame({
+        f"{col}_right" if col in clashes else col:
+            pd.api.extensions.take(landcover[col].to_numpy(), poly_idx, allow_fill=True)
+        for col in attr_cols
+    })
+    incidents = pd.concat(
+        [incidents.rename(columns={col: f"{col}_left" for col in clashes}), landcover_attrs],
+        axis=1
+    )
+    weather = weather.sort_values('timestamp', kind='mergesort')
+    # 72-hour means of all three series from one kernel call; transposed so
+    # each series is a contiguous row
+    rolled = rolling_mean_rows(
+        np.ascontiguousarray(weather[['temp', 'humidity', 'wind']].to_numpy().T), 72
+    )
+    weather[['temp_roll3', 'humidity_roll3', 'wind_roll3']] = rolled.T
+    # Attach the latest rolling weather at or before each incident's hour.
+    # Hour buckets are integer nanoseconds // HOUR_NS, joined by a two-pointer scan
+    merged = incidents.sort_values('timestamp', kind='mergesort')
+    incident_hours = merged['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64) // HOUR_NS
+    weather_hours = weather['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64) // HOUR_NS
+    roll_cols = ['temp_roll3', 'humidity_roll3', 'wind_roll3']
+    merged[roll_cols] = asof_backward(
+        incident_hours, weather_hours,
+        np.ascontiguousarray(weather[roll_cols].to_numpy())
     )
-    merged['hour'] = merged['incident_hour'].dt.hour
-    merged['dayofweek'] = merged['incident_hour'].dt.dayofweek
-    feature_cols = ['lat', 'lon', 'timestamp', 'type', 'temp', 'humidity', 'wind',
-                    'temp_roll3', 'humidity_roll3', 'wind_roll3', 'hour', 'dayofweek']
-    for col in landcover.columns:
-        if col not in feature_cols and col != 'geometry':
-            feature_cols.append(col)
+    # Calendar features straight from the int64 hour buckets (Monday=0;
+    # 1970-01-01 was a Thursday)
+    merged['hour'] = incident_hours % 24
+    merged['dayofweek'] = (incident_hours // 24 + 3) % 7
+    base_cols = pd.Index(['lat', 'lon', 'timestamp', 'type', 'temp', 'humidity', 'wind',
+                          'temp_roll3', 'humidity_roll3', 'wind_roll3', 'hour', 'dayofweek'])
+    # Landcover attributes not already in the base set, in their file order
+    extra_cols = landcover.columns.difference(base_cols, sort=False).drop('geometry', errors='ignore')
+    feature_cols = base_cols.append(extra_cols).tolist()
     features = merged[feature_cols].copy()
     print(f"Final feature set has {len(features)} rows and {len(features.columns)} columns.")
     return features
@@ -0,0 +1,106 @@
+"""
+Export the trained model to ONNX for onnxruntime inference
+
+Usage:
+    python export_onnx.py
+    python export_onnx.py --model models/heat_hazard_best_v4.joblib --output models/heat_hazard_best_v4.onnx
+
+Requires skl2onnx (export only); the API picks the .onnx file up at startup
+when onnxruntime is installed. The export is checked against the sklearn
+model on feature rows built the way the API builds them and is deleted if
+the scores or risk levels differ.
+"""
+
+import argparse
+import os
+import sys
+
+import joblib
+import numpy as np
+from sklearn.pipeline import Pipeline
+from skl2onnx import convert_sklearn
+from skl2onnx.common.data_types import FloatTensorType
+
+from main import N_FEATURES, PredictionRequest, get_risk_level, prepare_features
+
+
+def strip_samplers(model):
+    """Drop resampling steps (e.g. SMOTE), which only act during fit"""
+    if not hasattr(model, "steps"):
+        return model
+    steps = [(name, step) for name, step in model.steps if not hasattr(step, "fit_resample")]
+    return Pipeline(steps)
+
+
+def sample_feature_rows(n, seed=42):
+    """Feature rows built by the API from random but plausible Bangalore requests"""
+    rng = np.random.default_rng(seed)
+    X = np.empty((n, N_FEATURES), dtype=np.float32)
+    for i in range(n):
+        temp = rng.uniform(18, 42)
+        request = PredictionRequest(
+            lat=rng.uniform(12.8, 13.2),
+            lon=rng.uniform(77.4, 77.8),
+            date=f"2024-{rng.integers(1, 13):02d}-{rng.integers(1, 29):02d}",
+            hour=int(rng.integers(0, 24)),
+            temp=temp,
+            tavg=temp - rng.uniform(0, 6),
+            tmin=temp - rng.uniform(4, 12),
+            prcp=rng.choice([0.0, rng.uniform(0, 30)]),
+        )
+        prepare_features(request, out=X[i:i + 1])
+    return X
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the heat hazard model to ONNX")
+    parser.add_argument("--model", default="models/heat_hazard_best_v4.joblib",
+                        help="Trained joblib model")
+    parser.add_argument("--features", default="models/feature_list_v4.joblib",
+                        help="Feature list saved with the model")
+    parser.add_argument("--output", default="models/heat_hazard_best_v4.onnx",
+                        help="Output ONNX file")
+    parser.add_argument("--samples", type=int, default=2000,
+                        help="Number of feature rows used to verify the export")
+    parser.add_argument("--tolerance", type=float, default=1e-4,
+                        help="Largest accepted probability difference vs sklearn")
+    args = parser.parse_args()
+
+    model = strip_samplers(joblib.load(args.model))
+    n_features = len(joblib.load(args.features))
+    classifier = model.steps[-1][1] if hasattr(model, "steps") else model
+
+    # Plain probability tensor output instead of a list of {class: prob} maps
+    onx = convert_sklearn(
+        model,
+        initial_types=[("input", FloatTensorType([None, n_features]))],
+        options={id(classifier): {"zipmap": False}},
+    )
+    with open(args.output, "wb") as f:
+        f.write(onx.SerializeToString())
+    print(f"✅ ONNX model saved to: {args.output}")
+
+    # Compare against the sklearn model on realistic API feature rows; the
+    # export is deleted (and the API keeps scoring with sklearn) unless the
+    # scores agree to within --tolerance and give the same risk levels
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        print("⚠️ onnxruntime not installed, export not verified")
+        return
+    X = sample_feature_rows(args.samples)
+    session = ort.InferenceSession(args.output, providers=["CPUExecutionProvider"])
+    onnx_proba = session.run(None, {"input": X})[1][:, 1]
+    sklearn_proba = model.predict_proba(X)[:, 1]
+    diff = np.abs(onnx_proba - sklearn_proba).max()
+    level_mismatches = sum(
+        get_risk_level(a) != get_risk_level(b) for a, b in zip(onnx_proba, sklearn_proba)
+    )
+    print(f"Max probability difference vs sklearn: {diff:.2e} "
+          f"({level_mismatches} of {len(X)} risk levels differ)")
+    if diff > args.tolerance or level_mismatches:
+        os.remove(args.output)
+        sys.exit(f"❌ ONNX export does not match the sklearn model, removed {args.output}")
+
+if __name__ == "__main__":
+    main()
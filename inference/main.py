@@ -4,18 +4,36 @@ FastAPI service for real-time heat hazard risk assessment
 """
 
 import os
+
+# One OpenMP thread per process unless configured otherwise: requests are
+# served concurrently, so per-call thread pools would only oversubscribe the
+# cores. Must be set before numpy/sklearn load their OpenMP runtimes.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+import math
+import asyncio
 import joblib
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from typing import Optional, Dict, Any, List
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel, Field
 import uvicorn
 from fastapi.middleware.cors import CORSMiddleware
 
-# Initialize FastAPI app
+# ONNX Runtime is optional; without it the joblib model is used directly
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# Initialize FastAPI app. Responses use the default JSONResponse: on
+# FastAPI >= 0.130 the response_model routes (/predict, /predict_batch) are
+# serialized straight to JSON by pydantic-core, while the dict routes and
+# older releases go through jsonable_encoder + json.dumps
 app = FastAPI(
     title="Heat Hazard Risk Prediction API",
     description="Real-time heat hazard risk assessment for Bangalore",
@@ -41,6 +59,24 @@ model = None
 feature_list = None
 threshold = None
 scaler = None
+onnx_session = None
+
+# Feature vector constants
+N_FEATURES = 17
+HOUR_K = 2 * math.pi / 24
+MONTH_K = 2 * math.pi / 12
+# Cyclical encodings for the fixed hour (0-23) and month (1-12) domains,
+# computed once; MONTH_TRIG is indexed by month number directly
+HOUR_TRIG = tuple((math.sin(HOUR_K * h), math.cos(HOUR_K * h)) for h in range(24))
+MONTH_TRIG = tuple((math.sin(MONTH_K * m), math.cos(MONTH_K * m)) for m in range(13))
+# is_peak by hour (10:00-17:59) and is_weekend by day of week (Monday=0)
+IS_PEAK = (0,) * 10 + (1,) * 8 + (0,) * 6
+IS_WEEKEND = (0, 0, 0, 0, 0, 1, 1)
+
+# Micro-batching of concurrent /predict calls into one predict_proba
+MAX_BATCH = 64
+MAX_WAIT_MS = 5
+prediction_queue = None
 
 class PredictionRequest(BaseModel):
     lat: float = Field(..., ge=-90, le=90, description="Latitude")
@@ -66,13 +102,32 @@ class PredictionResponse(BaseModel):
     threshold: float = Field(..., description="Optimal threshold used")
     features_used: int = Field(..., description="Number of features used")
 
+class PredictionBatchRequest(BaseModel):
+    items: List[PredictionRequest] = Field(..., min_length=1, description="Prediction requests to score together")
+
+class PredictionBatchResponse(BaseModel):
+    predictions: List[PredictionResponse] = Field(..., description="Predictions in request order")
+
 def load_models():
     """Load the trained model and metadata"""
-    global model, feature_list, threshold, scaler
+    global model, feature_list, threshold, scaler, onnx_session
     
     try:
-        # Load the best model
-        model = joblib.load("models/heat_hazard_best_v4.joblib")
+        # Load the best model, preferring the uncompressed copy (written for
+        # models whose arrays stay memory-mapped read-only) unless it predates
+        # the lz4-compressed artifact, which is decompressed as usual
+        model_path = "models/heat_hazard_best_v4.joblib"
+        mmap_path = "models/heat_hazard_best_v4.mmap.joblib"
+        if os.path.exists(mmap_path) and (
+            not os.path.exists(model_path)
+            or os.path.getmtime(mmap_path) >= os.path.getmtime(model_path)
+        ):
+            model_path = mmap_path
+            model = joblib.load(model_path, mmap_mode="r")
+        else:
+            if os.path.exists(mmap_path):
+                print("⚠️ Memory-mapped model copy is older than the model, ignoring it")
+            model = joblib.load(model_path)
         print("✅ Model loaded successfully")
         
         # Load feature list
@@ -90,34 +145,54 @@ def load_models():
         except:
             print("⚠️ No scaler found, will use StandardScaler")
             scaler = None
+        
+        # Prefer the ONNX export (see export_onnx.py) for scoring if present,
+        # unless it predates the joblib model and so belongs to an older run
+        onnx_path = "models/heat_hazard_best_v4.onnx"
+        if ort is not None and os.path.exists(onnx_path):
+            if os.path.getmtime(onnx_path) < os.path.getmtime(model_path):
+                print("⚠️ ONNX export is older than the model, using the joblib model (re-run export_onnx.py)")
+            else:
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = 1
+                onnx_session = ort.InferenceSession(
+                    onnx_path, options, providers=["CPUExecutionProvider"]
+                )
+                print("✅ ONNX Runtime session loaded")
             
     except Exception as e:
         print(f"❌ Error loading models: {e}")
         raise
+    
+    # Warm up with a dummy prediction so lazy imports and first-touch page
+    # faults on the model arrays are paid at startup, not by the first request
+    try:
+        predict_scores(np.zeros((1, len(feature_list)), dtype=np.float32))
+        print("✅ Model warmed up")
+    except Exception as e:
+        print(f"⚠️ Model warm-up failed: {e}")
+
+@lru_cache(maxsize=4096)
+def parse_date(date: str):
+    """Return (dayofweek, month) for a YYYY-MM-DD string"""
+    date_obj = datetime.strptime(date, "%Y-%m-%d")
+    return date_obj.weekday(), date_obj.month
 
-def prepare_features(request: PredictionRequest) -> np.ndarray:
-    """Prepare features for prediction"""
+def prepare_features(request: PredictionRequest, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Prepare features for prediction
+    
+    Fills ``out`` (a (1, N_FEATURES) float32 row, e.g. a row view of a batch
+    matrix) in place, or a freshly allocated row when it is not given.
+    """
     # Parse date
     try:
-        date_obj = datetime.strptime(request.date, "%Y-%m-%d")
-        dayofweek = date_obj.weekday()
-        month = date_obj.month
-        dayofyear = date_obj.timetuple().tm_yday
+        dayofweek, month = parse_date(request.date)
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     
-    # Calculate derived features
-    temp_range = request.temp - request.tmin
-    heat_index = request.temp + 0.5 * request.tavg
-    is_peak = 1 if 10 <= request.hour <= 17 else 0
-    is_weekend = 1 if dayofweek in [5, 6] else 0
-    dist_center = np.hypot(request.lat - 12.9716, request.lon - 77.5946)
-    
-    # Cyclical encoding
-    hour_sin = np.sin(2 * np.pi * request.hour / 24)
-    hour_cos = np.cos(2 * np.pi * request.hour / 24)
-    month_sin = np.sin(2 * np.pi * month / 12)
-    month_cos = np.cos(2 * np.pi * month / 12)
+    if out is None:
+        out = np.empty((1, N_FEATURES), dtype=np.float32)
+    row = out[0]
     
     # Use provided rolling features or defaults
     temp_roll3 = request.temp_roll3 if request.temp_roll3 is not None else request.temp
@@ -125,15 +200,27 @@ def prepare_features(request: PredictionRequest) -> np.ndarray:
     tavg_roll3 = request.tavg_roll3 if request.tavg_roll3 is not None else request.tavg
     tavg_roll7 = request.tavg_roll7 if request.tavg_roll7 is not None else request.tavg
     
-    # Create feature vector in the same order as training
-    features = [
-        request.temp, request.tavg, request.tmin, request.prcp,
-        temp_roll3, temp_roll7, tavg_roll3, tavg_roll7,
-        temp_range, heat_index, is_peak, is_weekend,
-        dist_center, hour_sin, hour_cos, month_sin, month_cos
-    ]
+    # Fill the feature vector in the same order as training; scalar math
+    # module calls avoid per-call ufunc dispatch
+    row[0] = request.temp
+    row[1] = request.tavg
+    row[2] = request.tmin
+    row[3] = request.prcp
+    row[4] = temp_roll3
+    row[5] = temp_roll7
+    row[6] = tavg_roll3
+    row[7] = tavg_roll7
+    row[8] = request.temp - request.tmin  # temp_range
+    row[9] = request.temp + 0.5 * request.tavg  # heat_index
+    row[10] = IS_PEAK[request.hour]
+    row[11] = IS_WEEKEND[dayofweek]
+    row[12] = math.hypot(request.lat - 12.9716, request.lon - 77.5946)  # dist_center
     
-    return np.array(features).reshape(1, -1)
+    # Cyclical encoding from the precomputed tables
+    row[13], row[14] = HOUR_TRIG[request.hour]
+    row[15], row[16] = MONTH_TRIG[month]
+    
+    return out
 
 def get_risk_level(risk_score: float) -> str:
     """Convert risk score to risk level"""
@@ -146,11 +233,69 @@ def get_risk_level(risk_score: float) -> str:
     else:
         return "EXTREME"
 
+def predict_scores(features: np.ndarray) -> np.ndarray:
+    """Risk scores for an (n, N_FEATURES) feature matrix in one model call"""
+    # Scale features if scaler is available
+    if scaler is not None:
+        features = scaler.transform(features)
+    if onnx_session is not None:
+        # Outputs are [label, probabilities]
+        return onnx_session.run(None, {"input": features.astype(np.float32, copy=False)})[1][:, 1]
+    return model.predict_proba(features)[:, 1]
+
+def make_response(risk_score: float) -> PredictionResponse:
+    """Wrap a risk score in the API response"""
+    return PredictionResponse(
+        risk_score=risk_score,
+        risk_level=get_risk_level(risk_score),
+        threshold=threshold,
+        features_used=len(feature_list)
+    )
+
+async def batch_predictions():
+    """Coalesce queued single predictions into batched model calls
+    
+    Takes up to MAX_BATCH queued rows, waiting at most MAX_WAIT_MS after the
+    first one for more to arrive, and resolves each caller's future with its
+    own score.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        row, future = await prediction_queue.get()
+        rows, futures = [row], [future]
+        deadline = loop.time() + MAX_WAIT_MS / 1000
+        while len(rows) < MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                row, future = await asyncio.wait_for(prediction_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            rows.append(row)
+            futures.append(future)
+        
+        try:
+            scores = predict_scores(np.vstack(rows))
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future, score in zip(futures, scores):
+                if not future.done():
+                    future.set_result(float(score))
+
 @app.on_event("startup")
 async def startup_event():
     """Load models on startup"""
+    global prediction_queue
     print("🚀 Starting Heat Hazard Risk Prediction API...")
     load_models()
+    
+    # Start the micro-batching worker
+    prediction_queue = asyncio.Queue()
+    app.state.batch_task = asyncio.create_task(batch_predictions())
 
 @app.get("/")
 async def root():
@@ -183,21 +328,34 @@ async def predict_risk(request: PredictionRequest):
         # Prepare features
         features = prepare_features(request)
         
-        # Scale features if scaler is available
-        if scaler is not None:
-            features = scaler.transform(features)
+        # Queue the row for the batching worker and wait for its score
+        future = asyncio.get_running_loop().create_future()
+        await prediction_queue.put((features, future))
+        risk_score = await future
         
-        # Make prediction
-        risk_score = float(model.predict_proba(features)[0, 1])
+        return make_response(risk_score)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+@app.post("/predict_batch", response_model=PredictionBatchResponse)
+async def predict_risk_batch(request: PredictionBatchRequest):
+    """Predict heat hazard risk for several locations/conditions at once"""
+    
+    if model is None:
+        raise HTTPException(status_code=500, detail="Model not loaded")
+    
+    try:
+        # Prepare features straight into the rows of one matrix
+        features = np.empty((len(request.items), N_FEATURES), dtype=np.float32)
+        for i, item in enumerate(request.items):
+            prepare_features(item, out=features[i:i + 1])
         
-        # Determine risk level
-        risk_level = get_risk_level(risk_score)
+        # One model call for the whole batch
+        scores = predict_scores(features)
         
-        return PredictionResponse(
-            risk_score=risk_score,
-            risk_level=risk_level,
-            threshold=threshold,
-            features_used=len(feature_list)
+        return PredictionBatchResponse(
+            predictions=[make_response(float(score)) for score in scores]
         )
         
     except Exception as e:
@@ -213,7 +371,8 @@ async def model_info():
         "model_type": type(model).__name__,
         "features": feature_list,
         "threshold": threshold,
-        "scaler_available": scaler is not None
+        "scaler_available": scaler is not None,
+        "onnx_runtime": onnx_session is not None
     }
 
 if __name__ == "__main__":
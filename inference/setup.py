@@ -51,7 +51,7 @@ def install_dependencies():
             "fastapi",
             "uvicorn[standard]", 
             "joblib",
-            "pydantic",
+            "pydantic>=2.0.0",
             "numpy",
             "pandas",
             "scikit-learn"
@@ -55,6 +55,45 @@ def test_prediction():
     print(f"Response: {json.dumps(response.json(), indent=2)}")
     print()
 
+def test_batch_prediction():
+    """Test batch prediction endpoint"""
+    print("🔍 Testing batch prediction...")
+    
+    # Two locations scored in one request
+    payload = {
+        "items": [
+            {
+                "lat": 12.9716,
+                "lon": 77.5946,
+                "date": "2024-06-15",
+                "hour": 14,
+                "temp": 38.5,
+                "tavg": 75.0,
+                "tmin": 25.0,
+                "prcp": 0.0
+            },
+            {
+                "lat": 12.9352,
+                "lon": 77.6245,
+                "date": "2024-06-15",
+                "hour": 3,
+                "temp": 24.0,
+                "tavg": 27.0,
+                "tmin": 21.0,
+                "prcp": 0.0
+            }
+        ]
+    }
+    
+    response = requests.post(f"{BASE_URL}/predict_batch", json=payload)
+    print(f"Status: {response.status_code}")
+    print(f"Response: {json.dumps(response.json(), indent=2)}")
+    
+    # An empty batch is rejected by validation (expect 422)
+    response = requests.post(f"{BASE_URL}/predict_batch", json={"items": []})
+    print(f"Empty batch status: {response.status_code}")
+    print()
+
 def test_multiple_predictions():
     """Test multiple prediction scenarios"""
     print("🔍 Testing multiple prediction scenarios...")
@@ -121,6 +160,7 @@ if __name__ == "__main__":
         test_root()
         test_model_info()
         test_prediction()
+        test_batch_prediction()
         test_multiple_predictions()
         
         print("✅ All tests completed!")